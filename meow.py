@@ -1,49 +1,150 @@
+import binascii
+import functools
+import os
+import select
 import serial
+import struct
+import sys
 import time
 
 PORT = "/dev/ttyS4"
+FRAME_END = b"\x03\xFA"
+MAX_RESPONSE = 256
+ECHO_SLACK = 2
 
 def crc16_ccitt(data, crc=0x0000):
     """Вычисляет CRC16-CCITT для данных"""
-    for byte in data:
-        crc ^= (byte << 8)
-        for _ in range(8):
-            crc = (crc << 1) ^ 0x1021 if (crc & 0x8000) else (crc << 1)
-        crc &= 0xFFFF  
-    return crc
+    # crc_hqx - тот же CRC-16/XMODEM (полином 0x1021), но реализован на C
+    if not isinstance(data, (bytes, bytearray, memoryview)):
+        data = bytes(data)
+    return binascii.crc_hqx(data, crc)
 
-def foo(port, data):
-    frame = [0x52, 0x00]
-    frame.extend(data)
-    
-    crc = crc16_ccitt(frame)
-    frame.append(crc & 0xFF)        
-    frame.append((crc >> 8) & 0xFF) 
+@functools.lru_cache(maxsize=128)
+def build_frame(data):
+    """Собирает кадр: заголовок, данные, CRC (little-endian), ETX и SF.
+    Кадры кэшируются, поэтому data должна быть bytes"""
+    n = 2 + len(data)
+    frame = bytearray(n + 4)
+    frame[0] = 0x52
+    frame[1] = 0x00
+    frame[2:n] = data
     
-    frame.extend([0x03, 0xFA])
+    crc = crc16_ccitt(memoryview(frame)[:n])
+    struct.pack_into("<H", frame, n, crc)
     
-    frame_bytes = bytes(frame)
-    port.write(frame_bytes)
+    frame[n + 2:] = FRAME_END
+    return bytes(frame)
+
+def _read_chunk(port, size):
+    """Читает до size доступных байт; на POSIX - напрямую из fd через select + os.read.
+    Пустой результат означает таймаут"""
+    if os.name != "posix":
+        return port.read(min(size, port.in_waiting or 1))
+    fd = port.fileno()
+    deadline = None if port.timeout is None else time.monotonic() + port.timeout
+    while True:
+        remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+        ready, _, _ = select.select([fd], [], [], remaining)
+        if not ready:
+            return b""
+        try:
+            data = os.read(fd, size)
+        except (BlockingIOError, InterruptedError):
+            # порт открыт с O_NONBLOCK: ложное пробуждение select, ждём дальше как pyserial
+            continue
+        except OSError as e:
+            # например EIO при отключении USB-адаптера
+            raise serial.SerialException(f"read failed: {e}")
+        if not data:
+            raise serial.SerialException(
+                "device reports readiness to read but returned no data "
+                "(device disconnected?)")
+        return data
+
+def _find_echo(response, echo):
+    """Ищет эхо в начале response и возвращает индекс его конца или -1.
+    Глитч переключения направления RS-485 может добавить до ECHO_SLACK
+    мусорных байт перед эхом или испортить столько же байт в нём"""
+    i = response.find(echo, 0, len(echo) + ECHO_SLACK)
+    if i >= 0:
+        return i + len(echo)
+    for end in range(len(echo), min(len(response), len(echo) + ECHO_SLACK) + 1):
+        head = response[end - len(echo):end]
+        if sum(a != b for a, b in zip(head, echo)) <= ECHO_SLACK:
+            return end
+    return -1
+
+def read_response(port, sent=b""):
+    """Читает ответ до ETX SF, не дожидаясь фиксированной паузы.
+    На полудуплексной RS-485 сначала приходит эхо отправленного кадра sent:
+    оно отбрасывается (в том числе повреждённое), и чтение продолжается
+    до терминатора ответа.
+    Таймаут порта действует на каждый кусок, а не на весь ответ: без
+    терминатора чтение идёт, пока байты приходят с паузами меньше таймаута,
+    но не больше MAX_RESPONSE байт.
+    Возвращает (ответ, было ли эхо)"""
+    response = bytearray()
+    echo = sent
+    echoed = False
+    while len(response) < MAX_RESPONSE:
+        chunk = _read_chunk(port, MAX_RESPONSE - len(response))
+        if not chunk:
+            break
+        response += chunk
+        if echo:
+            end = _find_echo(response, echo)
+            if end >= 0:
+                del response[:end]
+                echo = b""
+                echoed = True
+        # неполное эхо (возможно, с мусором впереди) тоже может заканчиваться на 03 FA - ждём остаток
+        if response.endswith(FRAME_END) and not (echo and echo.startswith(response.lstrip(b"\x00\xFF"))):
+            break
+    return bytes(response), echoed
+
+def foo(port, data):
+    frame = build_frame(bytes(data))
+    port.reset_input_buffer()
+    port.write(frame)
     port.flush()
     
-    time.sleep(1)
-    
-    bytes_available = port.in_waiting
-    print(f"Bytes available: {bytes_available}")
-    
-    if bytes_available > 0:
-        response = port.read(bytes_available)
-    else:
-        response = port.read(64)  
+    response, echoed = read_response(port, frame)
+    if echoed:
+        print(f"Local echo dropped ({len(frame)} bytes)")
         
     if response:
-        print(f"Received ({len(response)} bytes):", " ".join(f"{b:02X}" for b in response))
+        print(f"Received ({len(response)} bytes):", response.hex(" ").upper())
         if len(response) >= 2:
             print(f"Response header: {response[0]:02X} {response[1]:02X}")
     else:
         print("No response received within timeout")
   
-    print("Sent:", " ".join(f"{b:02X}" for b in frame))
+    print("Sent:", frame.hex(" ").upper())
+    return response
+
+def _set_low_latency_ioctl(fd):
+    """Выставляет ASYNC_LOW_LATENCY через TIOCGSERIAL/TIOCSSERIAL (только Linux)"""
+    import array
+    import fcntl
+    import termios
+    buf = array.array("i", [0] * 32)
+    fcntl.ioctl(fd, termios.TIOCGSERIAL, buf)
+    buf[4] |= 0x2000  # serial_struct.flags |= ASYNC_LOW_LATENCY
+    fcntl.ioctl(fd, termios.TIOCSSERIAL, buf)
+
+def enable_low_latency(port):
+    """Отключает 16 мс буферизацию USB-адаптеров (FTDI), если драйвер это умеет"""
+    try:
+        port.set_low_latency_mode(True)
+    except AttributeError:
+        # старый pyserial без set_low_latency_mode
+        if sys.platform.startswith("linux"):
+            try:
+                _set_low_latency_ioctl(port.fileno())
+            except OSError:
+                pass
+    except (NotImplementedError, ValueError):
+        pass
 
 def main(): 
     port = serial.Serial(
@@ -54,6 +155,7 @@ def main():
         bytesize=serial.EIGHTBITS,
         timeout=1.0
     )
+    enable_low_latency(port)
     
     print("=== Test 1 ===")
     response1 = foo(port, [0x01, 0x01, 0x00])